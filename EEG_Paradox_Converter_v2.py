@@ -10,23 +10,33 @@ It is a simple converter that converts EDF files to WinEEG format.
 import sys
 import os
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import filedialog, messagebox
 import threading
-import time
+import queue
 from datetime import datetime
-import numpy as np
-from pathlib import Path
 
 # Add the current directory to path for imports
 sys.path.append(os.path.dirname(__file__))
 
 class EEGConverter:
+    # While background work is running (or messages are waiting), the Tk
+    # thread polls every LOG_POLL_MS, appending at most LOG_BATCH_MAX
+    # queued status messages per pass
+    LOG_POLL_MS = 50
+    LOG_BATCH_MAX = 200
+    LOG_MAX_LINES = 2000  # oldest lines are trimmed beyond this
+    
     def __init__(self, root):
         self.root = root
+        self.log_queue = queue.Queue()
+        self.ui_queue = queue.Queue()  # (callback, args) posted by worker threads
+        self.background_threads = []
+        self.polling = False
+        self.converting = False
         self.setup_ui()
         self.edf_file = None
+        self.edf_header = None
         self.output_file = None
-        self.conversion_thread = None
         
     def setup_ui(self):
         """Setup cyberpunk UI"""
@@ -291,14 +301,77 @@ User: El Chaderino"""
         credits.pack()
         
     def log_status(self, message, color='#ff4444'):
-        """Add message to status log"""
-        self.status_display.configure(state='normal')
+        """Queue message for the status log (safe to call from any thread)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        formatted_msg = f"[{timestamp}] {message}\n"
-        self.status_display.insert(tk.END, formatted_msg)
-        self.status_display.configure(state='disabled')
-        self.status_display.see(tk.END)
-        self.root.update()
+        self.log_queue.put_nowait(f"[{timestamp}] {message}\n")
+        
+        # Worker threads never touch Tk; the poll loop is already running
+        # for them. Messages logged from the Tk thread start it if needed.
+        if threading.current_thread() is threading.main_thread():
+            self.start_polling()
+    
+    def post_to_ui(self, callback, *args):
+        """Run callback(*args) on the Tk thread (safe to call from any thread)"""
+        self.ui_queue.put_nowait((callback, args))
+    
+    def start_background(self, target, *args):
+        """Run target(*args) on a daemon thread, polling for its output (Tk thread only)"""
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        self.background_threads.append(thread)
+        thread.start()
+        self.start_polling()
+    
+    def start_polling(self):
+        """Start the poll loop unless it is already running (Tk thread only)"""
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.LOG_POLL_MS, self.poll_background)
+    
+    def poll_background(self):
+        """Apply worker results and status messages; reschedule while work remains (Tk thread only)"""
+        # Check liveness before draining: anything a finished thread queued
+        # is already in the queues and is picked up by this pass
+        self.background_threads = [t for t in self.background_threads if t.is_alive()]
+        
+        while True:
+            try:
+                callback, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            # Show everything the worker logged before its result is applied
+            # (a callback may block in a modal dialog)
+            while not self.log_queue.empty():
+                self.drain_log_queue()
+            callback(*args)
+        
+        self.drain_log_queue()
+        
+        if self.background_threads or not self.log_queue.empty() or not self.ui_queue.empty():
+            self.root.after(self.LOG_POLL_MS, self.poll_background)
+        else:
+            self.polling = False
+    
+    def drain_log_queue(self):
+        """Append queued status messages to the log in one insert (Tk thread only)"""
+        batch = []
+        try:
+            while len(batch) < self.LOG_BATCH_MAX:
+                batch.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        
+        if batch:
+            self.status_display.configure(state='normal')
+            self.status_display.insert(tk.END, "".join(batch))
+            
+            # Keep the log bounded so long sessions don't grow the widget forever
+            n_lines = int(self.status_display.index('end-1c').split('.')[0]) - 1
+            excess = n_lines - self.LOG_MAX_LINES
+            if excess > 0:
+                self.status_display.delete('1.0', f'{excess + 1}.0')
+            
+            self.status_display.configure(state='disabled')
+            self.status_display.see(tk.END)
         
     def browse_edf_file(self):
         """Browse for EDF file"""
@@ -311,31 +384,52 @@ User: El Chaderino"""
             self.load_edf_file(file_path)
     
     def load_edf_file(self, file_path):
-        """Load and analyze EDF file"""
+        """Load EDF file and analyze its header in the background"""
+        self.edf_file = file_path
+        self.edf_header = None
+        filename = os.path.basename(file_path)
+        self.file_path_var.set(f"[LOADED] {filename}")
+        self.convert_btn.configure(state='disabled', bg='#003300')
+        
+        self.log_status(f"EDF file loaded: {filename}", '#00ff41')
+        self.log_status("Analyzing file structure...", '#ffff00')
+        
+        # Opening the file can stall on network shares; keep it off the Tk thread
+        self.start_background(self.read_edf_header_async, file_path)
+    
+    def read_edf_header_async(self, file_path):
+        """Read the EDF header on a worker thread and hand the result back to Tk"""
+        try:
+            # Bounded header read; MNE isn't needed just to inspect the file
+            from converter_core import read_edf_header
+            header = read_edf_header(file_path)
+            self.post_to_ui(self.on_edf_header_loaded, file_path, header)
+        except Exception as e:
+            self.post_to_ui(self.on_edf_header_failed, file_path, e)
+    
+    def on_edf_header_failed(self, file_path, error):
+        """Report a header read failure (Tk thread)"""
+        if file_path != self.edf_file:
+            return  # another file was selected meanwhile
+        self.log_status(f"ERROR loading file: {str(error)}", '#ff0000')
+        self.progress_var.set("ERROR")
+    
+    def on_edf_header_loaded(self, file_path, header):
+        """Show header info and prepare the output path (Tk thread)"""
+        if file_path != self.edf_file:
+            return  # another file was selected meanwhile
+        
         try:
-            self.edf_file = file_path
             filename = os.path.basename(file_path)
-            self.file_path_var.set(f"[LOADED] {filename}")
+            self.edf_header = header
+            duration_min = self.edf_header['duration_sec'] / 60
+            n_channels = self.edf_header['channels']
+            sfreq = self.edf_header['sfreq']
             
-            self.log_status(f"EDF file loaded: {filename}", '#00ff41')
-            self.log_status("Analyzing file structure...", '#ffff00')
+            self.log_status(f"Channels: {n_channels} | Duration: {duration_min:.1f}min | Rate: {sfreq:.0f}Hz", '#00ff41')
             
-            # Try to analyze with MNE
-            try:
-                import mne
-                raw = mne.io.read_raw_edf(file_path, preload=False, verbose=False)
-                duration_sec = raw.times[-1]
-                duration_min = duration_sec / 60
-                n_channels = len(raw.ch_names)
-                sfreq = raw.info['sfreq']
-                
-                self.log_status(f"Channels: {n_channels} | Duration: {duration_min:.1f}min | Rate: {sfreq:.0f}Hz", '#00ff41')
-                
-                if n_channels != 19:
-                    self.log_status(f"WARNING: Expected 19 channels, got {n_channels}", '#ffff00')
-                
-            except ImportError:
-                self.log_status("MNE not available, using basic analysis", '#ffff00')
+            if n_channels != 19:
+                self.log_status(f"WARNING: Expected 19 channels, got {n_channels}", '#ffff00')
             
             # Set default output filename
             base_name = os.path.splitext(filename)[0]
@@ -344,10 +438,11 @@ User: El Chaderino"""
             self.output_file = os.path.join(output_dir, output_name)
             self.output_path_var.set(f"[AUTO] {output_name}")
             
-            # Enable convert button
-            self.convert_btn.configure(state='normal', bg='#004400')
+            # Enable convert button (a running conversion re-enables it when done)
+            if not self.converting:
+                self.convert_btn.configure(state='normal', bg='#004400')
+                self.progress_var.set("LOADED - READY")
             self.log_status("READY TO CONVERT", '#00ff41')
-            self.progress_var.set("LOADED - READY")
             
         except Exception as e:
             self.log_status(f"ERROR loading file: {str(e)}", '#ff0000')
@@ -356,6 +451,7 @@ User: El Chaderino"""
     def clear_file(self):
         """Clear loaded file"""
         self.edf_file = None
+        self.edf_header = None
         self.output_file = None
         self.file_path_var.set("[NO FILE SELECTED]")
         self.output_path_var.set("[AUTO-GENERATED]")
@@ -387,104 +483,114 @@ User: El Chaderino"""
             messagebox.showerror("No Output", "Please specify an output file.")
             return
         
+        if self.converting:
+            return
+        
+        if self.edf_header is None:
+            messagebox.showerror("Not Ready", "The EDF file is still being analyzed (or could not be read).")
+            return
+        
         # Disable convert button during conversion
+        self.converting = True
         self.convert_btn.configure(state='disabled', text="[CONVERTING...]", bg='#333300')
         self.progress_var.set("CONVERTING")
         
-        # Start conversion in separate thread
-        self.conversion_thread = threading.Thread(target=self.convert_file)
-        self.conversion_thread.daemon = True
-        self.conversion_thread.start()
+        # Start conversion in separate thread, on a snapshot of the inputs:
+        # the user may load or clear a file while it runs
+        self.start_background(self.convert_file, self.edf_file, self.edf_header,
+                              self.output_file, self.patient_var.get())
     
-    def convert_file(self):
-        """Perform the actual conversion"""
+    def convert_file(self, edf_file, edf_header, output_file, patient_name):
+        """Perform the actual conversion (worker thread; no Tk calls)"""
         try:
             self.log_status("Starting conversion process...", '#00ff41')
             self.log_status("Phase 1: EDF >> Raw INT16", '#ffff00')
             
             # Step 1: Convert EDF to raw INT16
-            raw_file = self.edf_to_raw(self.edf_file)
+            raw_data = self.edf_to_raw(edf_file, edf_header)
             
             self.log_status("Phase 2: Template integration", '#ffff00')
             
-            # Step 2: Convert raw to EEG
-            success = self.raw_to_eeg(raw_file, self.output_file, self.patient_var.get())
+            # Step 2: Convert raw to EEG (frames stay in memory, no temp file)
+            success = self.raw_to_eeg(raw_data, output_file, patient_name, source=edf_file)
             
-            # Cleanup temp file
-            if os.path.exists(raw_file):
-                os.remove(raw_file)
+            # Free the frames now rather than holding them while the
+            # success dialog waits on the user
+            del raw_data
             
-            if success:
-                self.log_status("CONVERSION COMPLETE!", '#00ff41')
-                self.log_status(f"Output: {os.path.basename(self.output_file)}", '#00ff41')
-                self.progress_var.set("SUCCESS")
-                
-                # Show success dialog
-                result = messagebox.askquestion(
-                    "Conversion Complete", 
-                    f"EDF successfully Modded to WinEEG format!\n\nOutput: {self.output_file}\n\nOpen output folder?",
-                    icon='question'
-                )
-                
-                if result == 'yes':
-                    output_dir = os.path.dirname(self.output_file)
-                    os.startfile(output_dir)
-            else:
-                self.log_status("CONVERSION FAILED", '#ff0000')
-                self.progress_var.set("FAILED")
+            self.post_to_ui(self.on_conversion_finished, "SUCCESS" if success else "FAILED", output_file)
                 
         except Exception as e:
             self.log_status(f"CRITICAL ERROR: {str(e)}", '#ff0000')
-            self.progress_var.set("ERROR")
+            self.post_to_ui(self.on_conversion_finished, "ERROR", output_file)
+    
+    def on_conversion_finished(self, outcome, output_file):
+        """Report the conversion result and restore the controls (Tk thread)"""
+        self.converting = False
         
-        finally:
-            # Re-enable convert button
+        # Re-enable convert button only if the current file is ready
+        # (another file may have been loaded or cleared meanwhile)
+        if self.edf_header is not None:
             self.convert_btn.configure(state='normal', text="[Mod and CONVERT]\nEDF >> WinEEG", bg='#004400')
+        else:
+            self.convert_btn.configure(state='disabled', text="[Mod and CONVERT]\nEDF >> WinEEG", bg='#003300')
+        
+        self.progress_var.set(outcome)
+        
+        if outcome == "SUCCESS":
+            self.log_status("CONVERSION COMPLETE!", '#00ff41')
+            self.log_status(f"Output: {os.path.basename(output_file)}", '#00ff41')
+            
+            # The dialog blocks this pass of the poll loop; show the log first
+            self.drain_log_queue()
+            
+            # Show success dialog
+            result = messagebox.askquestion(
+                "Conversion Complete", 
+                f"EDF successfully Modded to WinEEG format!\n\nOutput: {output_file}\n\nOpen output folder?",
+                icon='question'
+            )
+            
+            if result == 'yes':
+                output_dir = os.path.dirname(output_file)
+                os.startfile(output_dir)
+        elif outcome == "FAILED":
+            self.log_status("CONVERSION FAILED", '#ff0000')
     
-    def edf_to_raw(self, edf_file):
+    def edf_to_raw(self, edf_file, edf_header):
         """Convert EDF to raw INT16 format using PROVEN scaling algorithm"""
-        import mne
+        from converter_core import quantize_to_frames
         
-        self.log_status("Loading EDF with MNE-Python...", '#ffff00')
-        raw = mne.io.read_raw_edf(edf_file, preload=True, verbose=False)
+        # Ensure we have 19 channels (header was already read when the file was loaded)
+        if edf_header['channels'] != 19:
+            raise ValueError(f"Expected 19 channels, got {edf_header['channels']}")
         
-        # Ensure we have 19 channels
-        if len(raw.ch_names) != 19:
-            raise ValueError(f"Expected 19 channels, got {len(raw.ch_names)}")
+        import mne
         
-        self.log_status("Converting to microvolts...", '#ffff00')
-        data = raw.get_data() * 1e6  # Convert to µV
+        self.log_status("Loading EDF with MNE-Python...", '#ffff00')
+        # Header only: get_data() decodes the samples straight into one array,
+        # instead of preloading a buffer and then copying it out
+        raw = mne.io.read_raw_edf(edf_file, preload=False, verbose=False)
         
         self.log_status("Applying FINAL scaling algorithm...", '#ffff00')
         # Final scaling to match template amplitude perfectly
         # User needs 500µV for EDF data vs ~50µV for template = 10x difference
         scaling_factor = 20  # Reduced 10x more to match template exactly
-        data_scaled = data * scaling_factor
-        
-        # Clip to INT16 range (same as working version)
-        data_clipped = np.clip(data_scaled, -32768, 32767)
-        
-        # Convert to INT16 
-        data_int16 = data_clipped.astype(np.int16)
         
         self.log_status("Interleaving channels (frame-by-frame)...", '#ffff00')
-        # Transpose to get (samples, channels) shape for frame-by-frame interleaving
-        n_channels, n_samples = data_int16.shape
-        data_transposed = data_int16.T  # Now (samples, channels)
-        
-        # Flatten to interleaved format: S0C0, S0C1, ..., S0C18, S1C0, S1C1, ...
-        interleaved = data_transposed.flatten()
+        # µV conversion, scaling, clipping and INT16 interleave in one place
+        frames = quantize_to_frames(raw.get_data(), scaling_factor)
+        n_samples, n_channels = frames.shape
         
-        # Save to temporary file
-        temp_file = os.path.join(os.path.dirname(self.output_file), "temp_raw_data.bin")
-        interleaved.tofile(temp_file)
+        # Interleaved format: S0C0, S0C1, ..., S0C18, S1C0, S1C1, ...
+        interleaved = frames.reshape(-1)
         
         self.log_status(f"Raw data: {n_samples:,} samples × {n_channels} channels", '#00ff41')
         self.log_status(f"Interleaved size: {len(interleaved):,} INT16 values", '#00ff41')
-        return temp_file
+        return interleaved
     
-    def raw_to_eeg(self, raw_file, output_file, patient_name):
-        """Convert raw data to EEG using template"""
+    def raw_to_eeg(self, raw_data, output_file, patient_name, source):
+        """Convert interleaved INT16 frames to EEG using template"""
         try:
             from converter_core import UniversalConverter
             
@@ -492,7 +598,7 @@ User: El Chaderino"""
             converter = UniversalConverter()
             
             self.log_status("Applying WinEEG template...", '#ffff00')
-            success = converter.convert_raw_to_eeg(raw_file, output_file, patient_name)
+            success = converter.convert_int16_to_eeg(raw_data, output_file, patient_name, source=source)
             
             if success:
                 self.log_status("Template integration successful", '#00ff41')
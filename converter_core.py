@@ -11,9 +11,19 @@ Author: EEG Paradox Development Team
 import os
 import sys
 import struct
+import functools
+import logging
 import numpy as np
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=2)
+def _read_template_bytes(template_path, mtime_ns, size):
+    """Read template file contents (cached per path, mtime and size)"""
+    with open(template_path, 'rb') as f:
+        return f.read()
+
 class UniversalConverter:
     """Universal EDF to WinEEG converter with proven algorithms"""
     
@@ -41,6 +51,12 @@ class UniversalConverter:
         17: (0x0337, False),  18: (0x0338, True),   # Marker channel - keep unchanged
     }
     
+    # Patient name fields as (offset, length) (discovered through analysis)
+    PATIENT_NAME_FIELDS = ((0x0080, 32), (0x00A0, 32), (0x00C0, 32), (0x0140, 32))
+    
+    # EEG (non-marker) channels, resolved once from the calibration table
+    EEG_CHANNELS = tuple(ch for ch, (_, is_marker) in CALIBRATION_OFFSETS.items() if not is_marker)
+    
     # Optimal calibration value for maximum sensitivity
     NEW_CALIBRATION_VALUE = 1  # 1 µV/bit
     
@@ -78,15 +94,18 @@ class UniversalConverter:
         
         raise FileNotFoundError("No suitable template found!")
     
+    def read_template(self, template_path):
+        """Read template bytes, reusing the cached copy while the file is unchanged"""
+        st = os.stat(template_path)
+        return _read_template_bytes(template_path, st.st_mtime_ns, st.st_size)
+    
     def read_int16(self, path, offset=0):
-        """Read raw INT16 data from file"""
-        with open(path, 'rb') as f:
-            f.seek(0, 2)
-            size = f.tell()
-        with open(path, 'rb') as f:
-            f.seek(offset)
-            data = np.frombuffer(f.read(size - offset), dtype='<i2')
-        return data
+        """Read raw INT16 data from file (memory-mapped, read-only)"""
+        # Map the file instead of copying it into a bytes buffer; pages
+        # are read on demand. np.memmap can't map an empty region.
+        if os.path.getsize(path) <= offset:
+            return np.empty(0, dtype='<i2')
+        return np.memmap(path, dtype='<i2', mode='r', offset=offset)
     
     def patch_patient_info(self, header_bytes, patient_name="EEG Paradox Patient"):
         """Patch patient/study information in header"""
@@ -94,13 +113,10 @@ class UniversalConverter:
         
         print("🔍 Patching patient/study information...")
         
-        # Patient name locations (discovered through analysis)
-        patient_locations = [(0x0080, 32), (0x00A0, 32), (0x00C0, 32), (0x0140, 32)]
-        patient_bytes = patient_name.encode('ascii', errors='ignore')[:31]
-        patient_bytes += b'\x00' * (32 - len(patient_bytes))
+        patient_bytes = patient_name.encode('ascii', errors='ignore')[:31].ljust(32, b'\x00')
         
         patches_made = 0
-        for offset, length in patient_locations:
+        for offset, length in self.PATIENT_NAME_FIELDS:
             if offset + length <= len(header):
                 header[offset:offset+length] = patient_bytes
                 patches_made += 1
@@ -114,6 +130,9 @@ class UniversalConverter:
         
         print("🔍 Patching calibration bytes...")
         
+        # Per-channel detail is debug output; don't format it unless it's wanted
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
         patches_made = 0
         for ch, (offset, is_marker) in self.CALIBRATION_OFFSETS.items():
             if offset < len(header):
@@ -121,27 +140,34 @@ class UniversalConverter:
                 if not is_marker:
                     header[offset] = self.NEW_CALIBRATION_VALUE
                     patches_made += 1
-                    print(f"   Ch{ch:02d} @ 0x{offset:04X}: {current_val:02X} → {self.NEW_CALIBRATION_VALUE:02X}")
+                    if debug:
+                        logger.debug("Ch%02d @ 0x%04X: %02X → %02X",
+                                     ch, offset, current_val, self.NEW_CALIBRATION_VALUE)
         
         print(f"   ✅ Patched {patches_made} calibration bytes (1 µV/bit sensitivity)")
         return bytes(header)
     
     def convert_raw_to_eeg(self, raw_file, output_file, patient_name="EEG Paradox Patient"):
-        """Convert raw INT16 data to WinEEG .EEG format"""
+        """Convert raw INT16 data file to WinEEG .EEG format"""
+        
+        # Check if raw data exists
+        if not os.path.exists(raw_file):
+            raise FileNotFoundError(f"Raw data file not found: {raw_file}")
+        
+        raw_data = self.read_int16(raw_file, offset=0)
+        return self.convert_int16_to_eeg(raw_data, output_file, patient_name, source=raw_file)
+    
+    def convert_int16_to_eeg(self, raw_data, output_file, patient_name="EEG Paradox Patient", source="memory"):
+        """Convert interleaved INT16 frames (already in memory) to WinEEG .EEG format"""
         
         print(f"🧠 EEG Paradox Universal Converter")
         print(f"=" * 60)
-        print(f"📥 Input raw data: {raw_file}")
+        print(f"📥 Input raw data: {source}")
         print(f"📤 Output EEG file: {output_file}")
         print(f"👤 Patient name: {patient_name}")
         
         try:
-            # Check if raw data exists
-            if not os.path.exists(raw_file):
-                raise FileNotFoundError(f"Raw data file not found: {raw_file}")
-            
             # --- Analyze raw data first ---
-            raw_data = self.read_int16(raw_file, offset=0)
             edf_frames = len(raw_data) // self.CH
             edf_duration_minutes = edf_frames / 250 / 60  # 250 Hz sampling
             
@@ -150,23 +176,21 @@ class UniversalConverter:
             # --- Choose appropriate template ---
             template_path = self.choose_template(edf_duration_minutes)
             
-            # --- Read chosen template ---
-            with open(template_path, 'rb') as f:
-                tpl = f.read()
+            # --- Read chosen template (cached across conversions) ---
+            tpl = self.read_template(template_path)
 
             if len(tpl) < self.HEADER + self.TRAILER:
                 raise ValueError("Template too small.")
 
+            tpl_view = memoryview(tpl)
             header = tpl[:self.HEADER]
-            trailer = tpl[-self.TRAILER:]
-            data_bytes = tpl[self.HEADER:-self.TRAILER]
+            data_bytes = tpl_view[self.HEADER:-self.TRAILER]
             
             if len(data_bytes) % self.FRAME != 0:
                 raise ValueError("Template data payload not multiple of frame bytes.")
 
             tpl_frames = len(data_bytes) // self.FRAME
-            tpl_i16 = np.frombuffer(data_bytes, dtype='<i2').copy()
-            tpl_frames19 = tpl_i16.reshape(tpl_frames, self.CH)
+            tpl_frames19 = np.frombuffer(data_bytes, dtype='<i2').reshape(tpl_frames, self.CH)
 
             print(f"📊 Template: {tpl_frames:,} frames ({tpl_frames/250/60:.1f} minutes)")
 
@@ -195,27 +219,27 @@ class UniversalConverter:
             patched_header = self.patch_patient_info(header, patient_name)
             patched_header = self.patch_calibration_bytes(patched_header)
 
-            # --- Build output frames ---
-            out = tpl_frames19.copy()
-
-            # Replace only EEG channels; preserve marker channels
-            PRESERVE = {0, 18}  # Channels 0 and 18 are markers
-            eeg_ch = [c for c in range(self.CH) if c not in PRESERVE]
+            # --- Build replacement window ---
+            # Only the replaced window is materialized; the rest of the
+            # template is streamed to the output unchanged
+            window = tpl_frames19[start:end].copy()
 
-            # Replace with EDF data
-            out[start:end, eeg_ch] = edf_frames19[:frames_to_use, eeg_ch]
+            # Replace only EEG channels; preserve marker channels (0 and 18)
+            eeg_ch = list(self.EEG_CHANNELS)
+            window[:, eeg_ch] = edf_frames19[:frames_to_use, eeg_ch]
 
             # --- Write output file ---
-            out_i16 = out.reshape(-1).astype('<i2', copy=False)
-
-            expected_size = self.HEADER + out_i16.nbytes + self.TRAILER
-            if expected_size != len(tpl):
-                raise ValueError(f"Size mismatch: expected {len(tpl)}, got {expected_size}")
+            # Header + template head + window + template tail/trailer, so the
+            # output is always exactly the template size
+            expected_size = len(tpl)
+            head_end = self.HEADER + start * self.FRAME
+            tail_start = self.HEADER + end * self.FRAME
 
             with open(output_file, 'wb') as f:
                 f.write(patched_header)
-                f.write(out_i16.tobytes(order='C'))
-                f.write(trailer)
+                f.write(tpl_view[self.HEADER:head_end])
+                window.tofile(f)  # serialize straight from the array buffer, no bytes copy
+                f.write(tpl_view[tail_start:])
 
             print(f"\n✅ Conversion successful!")
             print(f"   📄 Output: {output_file}")
@@ -231,8 +255,99 @@ class UniversalConverter:
             print(f"\n❌ Conversion failed: {str(e)}")
             raise e
 
+def read_edf_header(edf_file):
+    """
+    Read EDF header fields with a bounded read (no sample data, no MNE)
+    
+    Only the 256-byte fixed header and the 256 bytes per signal that
+    follow it are read, however large the recording is. Results are
+    cached while the file is unchanged, so treat them as read-only.
+    
+    Args:
+        edf_file (str): Path to EDF file
+    
+    Returns:
+        dict: channels, channel_names, sfreq, duration_sec
+    """
+    st = os.stat(edf_file)
+    return _read_edf_header_cached(edf_file, st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=32)
+def _read_edf_header_cached(edf_file, mtime_ns, file_size):
+    """Parse EDF header fields (cached per path, mtime and size)"""
+    with open(edf_file, 'rb') as f:
+        fixed = f.read(256)
+        if len(fixed) < 256:
+            raise ValueError(f"Not an EDF file (header too short): {edf_file}")
+        n_signals = int(fixed[252:256])
+        if n_signals <= 0:
+            raise ValueError(f"Not an EDF file (signal count {n_signals}): {edf_file}")
+        signals = f.read(n_signals * 256)
+        if len(signals) < n_signals * 256:
+            raise ValueError(f"Not an EDF file (signal headers truncated): {edf_file}")
+    
+    n_records = int(fixed[236:244])
+    record_duration = float(fixed[244:252])
+    if record_duration <= 0:
+        raise ValueError(f"Not an EDF file (record duration {record_duration}): {edf_file}")
+    
+    # Signal header fields are stored field by field across all signals
+    labels = [signals[i*16:(i+1)*16].decode('ascii', errors='ignore').strip()
+              for i in range(n_signals)]
+    spr_start = n_signals * 216  # label, transducer, dimension, 4x min/max, prefilter
+    samples_per_record = [int(signals[spr_start + i*8:spr_start + (i+1)*8])
+                          for i in range(n_signals)]
+    
+    if n_records < 0:
+        # Record count not written yet; derive it from the payload size
+        record_bytes = 2 * sum(samples_per_record)
+        if record_bytes == 0:
+            raise ValueError(f"Not an EDF file (empty data records): {edf_file}")
+        n_records = (file_size - 256 * (n_signals + 1)) // record_bytes
+    
+    # EDF+ annotation signals aren't EEG channels (MNE drops them too)
+    eeg = [(label, spr) for label, spr in zip(labels, samples_per_record)
+           if label != "EDF Annotations"]
+    
+    return {
+        'channels': len(eeg),
+        'channel_names': [label for label, _ in eeg],
+        'sfreq': max(spr for _, spr in eeg) / record_duration if eeg else 0.0,
+        'duration_sec': n_records * record_duration,
+    }
+
+def quantize_to_frames(data, scaling_factor):
+    """
+    Quantize EDF data to interleaved INT16 frames
+    
+    Works in place on data, so pass an array you no longer need
+    (e.g. a fresh raw.get_data() result).
+    
+    Args:
+        data (np.ndarray): (channels, samples) array in volts
+        scaling_factor (float): INT16 counts per µV
+    
+    Returns:
+        np.ndarray: (samples, channels) '<i2' array, i.e.
+        sample0_ch0, sample0_ch1, ..., sample0_ch18, sample1_ch0, ...
+    """
+    # V -> µV -> INT16 counts. Kept as two multiplies: folding them into
+    # one constant rounds differently and shifts truncated samples by ±1
+    np.multiply(data, 1e6, out=data)  # Convert to µV
+    np.multiply(data, scaling_factor, out=data)
+    
+    # Clip to INT16 range
+    np.clip(data, -32768, 32767, out=data)
+    
+    # Cast into a sample-major buffer: the transpose happens in the same
+    # pass as the INT16 conversion, with no extra copy
+    n_channels, n_samples = data.shape
+    frames = np.empty((n_samples, n_channels), dtype='<i2')
+    np.copyto(frames, data.T, casting='unsafe')
+    return frames
+
 # Standalone conversion function for command-line use
-def convert_edf_to_wineeg(edf_file, output_file, patient_name="EEG Paradox Patient"):
+def convert_edf_to_wineeg(edf_file, output_file, patient_name="EEG Paradox Patient", header=None):
     """
     Standalone conversion function
     
@@ -240,57 +355,34 @@ def convert_edf_to_wineeg(edf_file, output_file, patient_name="EEG Paradox Patie
         edf_file (str): Path to input EDF file
         output_file (str): Path to output .EEG file
         patient_name (str): Patient name to embed in header
+        header (dict): read_edf_header() result for edf_file, if the caller
+            already has it
     
     Returns:
         bool: True if successful, False otherwise
     """
     try:
+        # Ensure we have 19 channels (from the header, before loading MNE)
+        if header is None:
+            header = read_edf_header(edf_file)
+        if header['channels'] != 19:
+            raise ValueError(f"Expected 19 channels, got {header['channels']}")
+        
         import mne
         
         # Step 1: Convert EDF to raw INT16
         print("🔄 Converting EDF to raw data...")
-        raw = mne.io.read_raw_edf(edf_file, preload=True, verbose=False)
-        
-        # Ensure we have 19 channels
-        if len(raw.ch_names) != 19:
-            raise ValueError(f"Expected 19 channels, got {len(raw.ch_names)}")
-        
-        # Get data and convert to microvolts
-        data = raw.get_data() * 1e6  # Convert to µV
-        
-        # Scale to INT16 range
-        scaling_factor = 10_000_000
-        data_scaled = data * scaling_factor
-        
-        # Clip to INT16 range
-        data_clipped = np.clip(data_scaled, -32768, 32767)
+        # Header only: get_data() decodes the samples straight into one array,
+        # instead of preloading a buffer and then copying it out
+        raw = mne.io.read_raw_edf(edf_file, preload=False, verbose=False)
         
-        # Convert to INT16 and interleave
-        data_int16 = data_clipped.astype(np.int16)
+        # Scale to INT16 range and interleave into frames
+        interleaved = quantize_to_frames(raw.get_data(), scaling_factor=10_000_000).reshape(-1)
         
-        # Interleave: sample0_ch0, sample0_ch1, ..., sample0_ch18, sample1_ch0, ...
-        n_samples, n_channels = data_int16.shape
-        interleaved = np.zeros((n_samples * n_channels,), dtype=np.int16)
-        
-        for sample in range(n_samples):
-            start_idx = sample * n_channels
-            end_idx = start_idx + n_channels
-            interleaved[start_idx:end_idx] = data_int16[sample, :]
-        
-        # Save to temporary file
-        temp_file = output_file.replace('.eeg', '_temp_raw.bin')
-        interleaved.tofile(temp_file)
-        
-        # Step 2: Convert raw to EEG
+        # Step 2: Convert raw to EEG (handed over in memory, no temp file round-trip)
         print("🔧 Converting raw to WinEEG format...")
         converter = UniversalConverter()
-        success = converter.convert_raw_to_eeg(temp_file, output_file, patient_name)
-        
-        # Cleanup temp file
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-        
-        return success
+        return converter.convert_int16_to_eeg(interleaved, output_file, patient_name, source=edf_file)
         
     except Exception as e:
         print(f"❌ Conversion failed: {str(e)}")
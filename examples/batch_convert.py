@@ -11,20 +11,50 @@ Usage:
 
 import sys
 import os
-import glob
+import io
+import contextlib
+import concurrent.futures as cf
 from pathlib import Path
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from converter_core import convert_edf_to_wineeg
+from converter_core import convert_edf_to_wineeg, read_edf_header
 
-def batch_convert(input_folder, output_folder, patient_prefix="Patient"):
+# Upper bound on default worker count; more processes just contend for the disk
+MAX_DEFAULT_WORKERS = 8
+
+# Size of the EDF fixed header; anything smaller cannot be an EDF file
+EDF_HEADER_BYTES = 256
+
+# Input file extensions picked up from the folder (compared lowercased)
+EDF_EXTENSIONS = frozenset({'.edf'})
+
+def _convert_quietly(edf_file, output_file, patient_name, header):
+    """
+    Run convert_edf_to_wineeg in a worker with its console output captured
+    
+    Parallel workers share the parent's stdout, so their progress prints
+    would interleave; only the parent reports.
+    
+    Returns:
+        tuple: (success, captured output text)
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        success = convert_edf_to_wineeg(edf_file, output_file, patient_name, header)
+    return success, log.getvalue()
+
+def batch_convert(input_folder, output_folder, patient_prefix="Patient", workers=None):
     """
     Convert all EDF files in input folder to WinEEG format
     
+    Files are independent, so they are converted in parallel worker
+    processes (NumPy scaling is CPU-bound and processes avoid the GIL).
+    
     Args:
         input_folder (str): Folder containing EDF files
         output_folder (str): Folder for output EEG files
         patient_prefix (str): Prefix for patient names
+        workers (int): Number of worker processes (default: CPU count, max 8)
     """
     
     print("🧠 EEG Paradox Batch Converter")
@@ -38,50 +68,97 @@ def batch_convert(input_folder, output_folder, patient_prefix="Patient"):
     # Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
     
-    # Find all EDF files
-    edf_pattern = os.path.join(input_folder, "*.edf")
-    edf_files = glob.glob(edf_pattern)
+    # Find all EDF files (scandir entries carry name and stat info, so
+    # no separate basename/stat calls are needed per file); the name check
+    # comes first so non-EDF entries never reach is_file()
+    with os.scandir(input_folder) as entries:
+        edf_files = [e for e in entries
+                     if os.path.splitext(e.name)[1].lower() in EDF_EXTENSIONS and e.is_file()]
     
     if not edf_files:
         print(f"❌ No EDF files found in: {input_folder}")
         return False
     
+    # Largest first, so the longest conversions don't start last
+    edf_files.sort(key=lambda e: e.stat().st_size, reverse=True)
+    
+    if workers is None:
+        workers = min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)
+    
     print(f"📁 Input folder: {input_folder}")
     print(f"📁 Output folder: {output_folder}")
     print(f"📊 Found {len(edf_files)} EDF files")
+    print(f"⚙️  Workers: {workers}")
     print("")
     
     # Convert each file
     successful = 0
     failed = 0
     
-    for i, edf_file in enumerate(edf_files, 1):
-        filename = os.path.basename(edf_file)
-        base_name = os.path.splitext(filename)[0]
-        
-        # Generate output filename and patient name
-        output_file = os.path.join(output_folder, f"{base_name}_WinEEG.eeg")
-        patient_name = f"{patient_prefix}_{base_name}"
-        
-        print(f"[{i}/{len(edf_files)}] Converting: {filename}")
-        print(f"   👤 Patient: {patient_name}")
-        
+    # Reject files that would fail immediately before they reach a worker:
+    # the size comes from the cached scandir stat, the header is a bounded read
+    convertible = []
+    for entry in edf_files:
         try:
-            success = convert_edf_to_wineeg(edf_file, output_file, patient_name)
-            
-            if success:
-                print(f"   ✅ Success: {base_name}_WinEEG.eeg")
-                successful += 1
-            else:
-                print(f"   ❌ Failed: {filename}")
-                failed += 1
-                
+            if entry.stat().st_size < EDF_HEADER_BYTES:
+                raise ValueError("smaller than an EDF header")
+            header = read_edf_header(entry.path)
+            if header['channels'] != 19:
+                raise ValueError(f"Expected 19 channels, got {header['channels']}")
         except Exception as e:
-            print(f"   ❌ Error: {str(e)}")
+            # One bad file must not end the batch; skip it and carry on
+            print(f"⏭️  Skipped: {entry.name} ({str(e)})")
             failed += 1
-        
+            continue
+        convertible.append((entry, header))
+    
+    if failed:
         print("")
     
+    # Output path and patient name prefixes, built once (plain concatenation,
+    # since folder names and prefixes may contain format braces)
+    output_dir_prefix = os.path.join(output_folder, "")
+    patient_name_prefix = patient_prefix + "_"
+    
+    with cf.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for entry, header in convertible:
+            filename = entry.name
+            base_name = os.path.splitext(filename)[0]
+            
+            output_file = output_dir_prefix + base_name + "_WinEEG.eeg"
+            patient_name = patient_name_prefix + base_name
+            
+            future = executor.submit(_convert_quietly, entry.path, output_file, patient_name, header)
+            futures[future] = (filename, base_name, patient_name)
+        
+        # Report in completion order
+        for i, future in enumerate(cf.as_completed(futures), 1):
+            filename, base_name, patient_name = futures[future]
+            
+            print(f"[{i}/{len(futures)}] Finished: {filename}")
+            print(f"   👤 Patient: {patient_name}")
+            
+            try:
+                success, log = future.result()
+                
+                if success:
+                    print(f"   ✅ Success: {base_name}_WinEEG.eeg")
+                    successful += 1
+                else:
+                    print(f"   ❌ Failed: {filename}")
+                    # The converter's last message is the failure reason
+                    reason = log.strip().splitlines()
+                    if reason:
+                        print(f"      {reason[-1].strip()}")
+                    failed += 1
+                    
+            except Exception as e:
+                print(f"   ❌ Error: {str(e)}")
+                failed += 1
+            
+            print("")
+    
     # Summary
     print("=" * 40)
     print(f"📊 Batch Conversion Summary:")
@@ -99,32 +176,47 @@ def batch_convert(input_folder, output_folder, patient_prefix="Patient"):
 def main():
     """Main entry point"""
     
+    usage = "Usage: python batch_convert.py INPUT_FOLDER OUTPUT_FOLDER [PATIENT_PREFIX] [WORKERS]"
+    
     if len(sys.argv) < 3:
         print("🧠 EEG Paradox Batch Converter")
         print("=" * 35)
-        print("Usage: python batch_convert.py INPUT_FOLDER OUTPUT_FOLDER [PATIENT_PREFIX]")
+        print(usage)
         print("")
         print("Examples:")
         print("  python batch_convert.py ./edf_files/ ./wineeg_files/")
         print("  python batch_convert.py C:/Data/EDF/ C:/Data/WinEEG/ \"Study_A\"")
+        print("  python batch_convert.py C:/Data/EDF/ C:/Data/WinEEG/ \"Study_A\" 4")
         print("")
         print("Features:")
         print("  • Converts all .edf files in input folder")
         print("  • Automatic output naming (filename_WinEEG.eeg)")
         print("  • Custom patient name prefixes")
+        print("  • Parallel conversion (one worker per CPU core, max 8)")
         print("  • Progress tracking and error reporting")
         return 1
     
     input_folder = sys.argv[1]
     output_folder = sys.argv[2]
     patient_prefix = sys.argv[3] if len(sys.argv) > 3 else "Patient"
+    workers = None
+    
+    if len(sys.argv) > 4:
+        try:
+            workers = int(sys.argv[4])
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            print(f"❌ WORKERS must be a positive integer, got: {sys.argv[4]}")
+            print(usage)
+            return 1
     
     # Normalize paths
     input_folder = os.path.abspath(input_folder)
     output_folder = os.path.abspath(output_folder)
     
     # Perform batch conversion
-    success = batch_convert(input_folder, output_folder, patient_prefix)
+    success = batch_convert(input_folder, output_folder, patient_prefix, workers)
     
     return 0 if success else 1
 
@@ -11,6 +11,7 @@ Usage:
 
 import sys
 import os
+import stat
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from converter_core import convert_edf_to_wineeg
@@ -40,11 +41,17 @@ def main():
     output_file = sys.argv[2]
     patient_name = sys.argv[3] if len(sys.argv) > 3 else "EEG Paradox Patient"
     
-    # Validate input
-    if not os.path.exists(edf_file):
+    # Validate input with a single stat (also catches a folder passed as input)
+    try:
+        st = os.stat(edf_file)
+    except OSError:
         print(f"❌ Error: Input file not found: {edf_file}")
         return 1
     
+    if not stat.S_ISREG(st.st_mode):
+        print(f"❌ Error: Input is not a file: {edf_file}")
+        return 1
+    
     if not edf_file.lower().endswith('.edf'):
         print(f"⚠️  Warning: Input file doesn't have .edf extension")
     